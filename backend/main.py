@@ -1,18 +1,18 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse
+import asyncio
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from lxml.etree import strip_elements
 import io
-import tempfile
 import os
-from difflib import unified_diff
 import logging
 import csv
 import re
-from functools import lru_cache
-from concurrent.futures import ThreadPoolExecutor
 import threading
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,65 +30,79 @@ app.add_middleware(
     expose_headers=["Content-Disposition"],
 )
 
-# Thread pool for parallel processing
-thread_pool = ThreadPoolExecutor(max_workers=4)
+# One libxml2 parser per thread: reusing it keeps its internal buffers and
+# error-recovery tables warm instead of re-allocating them per document, but
+# lxml parser objects are not thread-safe, so requests running concurrently
+# in the threadpool must not share one
+_parser_local = threading.local()
+
+def _get_html_parser():
+    parser = getattr(_parser_local, 'parser', None)
+    if parser is None:
+        parser = lxml_html.HTMLParser(recover=True, remove_comments=True, remove_pis=True)
+        _parser_local.parser = parser
+    return parser
 
-# Cache for HTML parsing and price extraction
-@lru_cache(maxsize=1000)
 def html_to_text(html_content):
-    """Convert HTML to text with caching for better performance."""
+    """Convert HTML to text."""
+    # Guard against NaN/None cells coming out of pandas
+    if not isinstance(html_content, str) or not html_content:
+        return ''
+    # Plain-text cells are common; when there is no markup at all, skip
+    # DOM construction and just normalize the whitespace
+    if '<' not in html_content:
+        return ' '.join(html_content.split())
     try:
-        # Use lxml parser for better performance
-        soup = BeautifulSoup(html_content, 'lxml')
+        # Parse with lxml directly; it keeps the tree in C instead of
+        # building a Python object per node like BeautifulSoup
+        tree = lxml_html.fromstring(html_content, parser=_get_html_parser())
         # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
+        strip_elements(tree, 'script', 'style', with_tail=False)
         # Get text and normalize whitespace
-        text = soup.get_text(separator=' ', strip=True)
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        return text
+        return ' '.join(tree.text_content().split())
     except Exception as e:
         logger.error(f"Error converting HTML to text: {str(e)}")
         return str(html_content)
 
-# Compile regex pattern once for better performance
+# Compile regex pattern once for better performance. The currency
+# alternation and the amount grammar are factored into single subpatterns
+# shared by the symbol-prefix and symbol-suffix forms, which keeps the
+# alternation shallow and backtracking to a minimum.
+_CURRENCY = r'(?:[\$₱£€¥₹]|PHP|USD|EUR|GBP|JPY|INR)'
+_AMOUNT = r'\d+(?:,\d{3})*(?:\.\d{2})?'
+# re.ASCII skips Unicode case folding and digit classes; every casing and
+# digit in the grammar is plain ASCII
 PRICE_PATTERN = re.compile(
-    r'(?:(?:[\$₱£€¥₹]|(?:PHP|USD|EUR|GBP|JPY|INR))\s*\d+(?:,\d{3})*(?:\.\d{2})?|\d+(?:,\d{3})*(?:\.\d{2})?\s*(?:[\$₱£€¥₹]|(?:PHP|USD|EUR|GBP|JPY|INR)))',
-    re.IGNORECASE
+    r'(?:{cur}\s*{amt}|{amt}\s*{cur})'.format(cur=_CURRENCY, amt=_AMOUNT),
+    re.IGNORECASE | re.ASCII
 )
 
-@lru_cache(maxsize=1000)
+# Cheap prefilter: most descriptions contain no currency token at all, so
+# the full pattern can be skipped unless a currency symbol or ISO code is
+# actually present.
+_CURRENCY_CHARS = '$₱£€¥₹'
+_CURRENCY_CODES = re.compile(r'PHP|USD|EUR|GBP|JPY|INR', re.IGNORECASE | re.ASCII)
+
 def extract_prices(text):
-    """Extract prices from text with caching for better performance."""
-    if not text:
+    """Extract prices from text."""
+    if not isinstance(text, str) or not text:
         return ''
-    prices = PRICE_PATTERN.findall(text)
-    return ' | '.join(prices) if prices else ''
+    # Each `in` check is a C-level substring scan; no set of the whole
+    # text gets allocated just to test membership
+    if not (any(c in text for c in _CURRENCY_CHARS) or _CURRENCY_CODES.search(text)):
+        return ''
+    # finditer feeds the join directly without building a match list first
+    return ' | '.join(m.group() for m in PRICE_PATTERN.finditer(text))
 
-def process_row(args):
-    """Process a single row of data."""
-    row, product_col1, html_col, df2, product_col2, desc_col = args
-    try:
-        product_number = row[product_col1]
-        html_content = row[html_col]
-        text_content = html_to_text(html_content)
-        
-        matching_product = df2[df2[product_col2] == product_number]
-        if not matching_product.empty:
-            product_description = matching_product.iloc[0][desc_col]
-            prices1 = extract_prices(text_content)
-            prices2 = extract_prices(product_description)
-            return [
-                product_number,
-                text_content,
-                product_description,
-                prices1,
-                prices2
-            ]
-    except Exception as e:
-        logger.error(f"Error processing row: {str(e)}")
-    return None
+def iter_csv(df, chunk_rows=10000):
+    """Yield a DataFrame as CSV text chunk by chunk."""
+    buf = io.StringIO()
+    df.iloc[:0].to_csv(buf, index=False)
+    yield buf.getvalue()
+    for start in range(0, len(df), chunk_rows):
+        buf = io.StringIO()
+        df.iloc[start:start + chunk_rows].to_csv(buf, index=False, header=False)
+        yield buf.getvalue()
 
 def validate_csv_structure(df1, df2):
     """Validate the structure of both files with improved error handling."""
@@ -105,55 +119,142 @@ def validate_csv_structure(df1, df2):
     
     return df1_columns[0], df1_columns[1], df2_columns[1], df2_columns[3]
 
+def read_df(contents, filename):
+    """Parse uploaded file bytes into a DataFrame."""
+    # The Arrow engine parses CSV multi-threaded in C++ and backs string
+    # columns with Arrow buffers instead of one Python object per cell
+    if filename.endswith(".csv"):
+        return pd.read_csv(io.BytesIO(contents), engine='pyarrow', dtype_backend='pyarrow')
+    return pd.read_excel(io.BytesIO(contents))
+
+def _missing_count(series):
+    """Count missing values, treating NaN as missing on every backend."""
+    # Arrow float columns report NaN as valid, so isna() alone undercounts
+    # there; series != series flags NaN regardless of backend, and the two
+    # masks are OR-ed so numpy floats (where isna() does see NaN) are not
+    # counted twice
+    mask = (series.isna().to_numpy(dtype=bool)
+            | (series != series).fillna(False).to_numpy(dtype=bool))
+    return int(mask.sum())
+
+def align_key_dtypes(df1, df2, key1, key2):
+    """Cast both product-number columns to a shared dtype before joining."""
+    # Hashing fixed-width numbers beats hashing Python string objects, and
+    # a dtype mismatch between the two files (one read as numbers, the
+    # other as strings) would make every join probe miss
+    n1 = pd.to_numeric(df1[key1], errors='coerce')
+    n2 = pd.to_numeric(df2[key2], errors='coerce')
+    # Coercion failures can come back as NaN floats rather than proper NA
+    # (Arrow-backed columns do this, and Arrow NaN doesn't count as null),
+    # so compare missing counts against the originals instead of trusting
+    # notna()
+    if (_missing_count(n1) == _missing_count(df1[key1])
+            and _missing_count(n2) == _missing_count(df2[key2])):
+        df1[key1] = n1
+        df2[key2] = n2
+    else:
+        # Keep missing keys missing; a bare astype(str) would turn them
+        # into the literal string 'nan' and let blank SKUs join each other
+        df1[key1] = df1[key1].astype(str).mask(df1[key1].isna())
+        df2[key2] = df2[key2].astype(str).mask(df2[key2].isna())
+
+def build_result(df1, df2):
+    """Run the full comparison pipeline and return the result DataFrame."""
+    # Validate file structure and get column names
+    product_col1, html_col, product_col2, desc_col = validate_csv_structure(df1, df2)
+
+    # Line the key dtypes up before encoding and joining, then drop rows
+    # with no key at all: merge treats NaN keys as equal, so blank SKUs
+    # would otherwise join against each other. The explicit copies keep
+    # the category casts below from tripping the chained-assignment warning
+    align_key_dtypes(df1, df2, product_col1, product_col2)
+    df1 = df1.dropna(subset=[product_col1]).copy()
+    df2 = df2.dropna(subset=[product_col2]).copy()
+
+    # SKU strings repeat across rows; dictionary-encode both key columns on
+    # a shared category set so the merge compares integer codes instead of
+    # Python strings
+    df1[product_col1] = df1[product_col1].astype('category')
+    df2[product_col2] = df2[product_col2].astype(df1[product_col1].dtype)
+
+    # Join the two files once on the product number instead of scanning
+    # df2 for every row of df1. df2 can repeat a product number; keep the
+    # first occurrence (what the old .iloc[0] lookup returned) so the
+    # merge stays many-to-one instead of fanning rows out
+    merged = df1.merge(
+        df2[[product_col2, desc_col]]
+        .drop_duplicates(subset=[product_col2])
+        .rename(columns={product_col2: product_col1}),
+        on=product_col1,
+        how='inner',
+        validate='m:1'
+    )
+
+    if merged.empty:
+        logger.error("No data was processed successfully")
+        raise HTTPException(status_code=400, detail="No data was processed successfully")
+
+    # Catalogs reuse template HTML across SKUs, so parse each distinct blob
+    # once and map the texts back onto the rows
+    uniq_html = merged[html_col].dropna().unique()
+
+    # HTML parsing is CPU-bound, so fan it out across processes for big
+    # uploads; threads would just serialize on the GIL. Only plain
+    # strings are marshalled to the workers, never the DataFrames.
+    if len(uniq_html) >= 500:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            texts = list(executor.map(html_to_text, uniq_html, chunksize=64))
+    else:
+        # Small inputs are not worth the pool startup cost
+        texts = [html_to_text(h) for h in uniq_html]
+    text_map = dict(zip(uniq_html, texts))
+    merged['Natural Language Output'] = merged[html_col].map(text_map).fillna('')
+    # The raw HTML is by far the largest column and is never read again;
+    # free it before the regex stage
+    merged.drop(columns=[html_col], inplace=True)
+    merged['LAZADA PRICES'] = merged['Natural Language Output'].map(extract_prices)
+    merged['SHOPEE PRICES'] = merged[desc_col].map(extract_prices)
+
+    # Build the result by column selection
+    return merged.rename(columns={
+        product_col1: 'Product Number',
+        desc_col: 'Product Description'
+    })[[
+        'Product Number',
+        'Natural Language Output',
+        'Product Description',
+        'LAZADA PRICES',
+        'SHOPEE PRICES'
+    ]]
+
 @app.post("/process-csv")
 async def process_csv(file1: UploadFile = File(...), file2: UploadFile = File(...)):
     try:
         logger.info("Starting file processing")
         logger.info(f"Received files: {file1.filename}, {file2.filename}")
-        
+
         if not file1 or not file2:
             raise HTTPException(status_code=400, detail="Both files are required")
-        
-        # Read files into DataFrames
-        df1 = pd.read_csv(file1.file) if file1.filename.endswith(".csv") else pd.read_excel(file1.file)
-        df2 = pd.read_csv(file2.file) if file2.filename.endswith(".csv") else pd.read_excel(file2.file)
-        
-        # Validate file structure and get column names
-        product_col1, html_col, product_col2, desc_col = validate_csv_structure(df1, df2)
-        
-        # Prepare arguments for parallel processing
-        process_args = [(row, product_col1, html_col, df2, product_col2, desc_col) 
-                       for _, row in df1.iterrows()]
-        
-        # Process rows in parallel
-        processed_data = []
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            results = list(executor.map(process_row, process_args))
-            processed_data = [r for r in results if r is not None]
-        
-        if not processed_data:
-            logger.error("No data was processed successfully")
-            raise HTTPException(status_code=400, detail="No data was processed successfully")
-        
-        # Create new DataFrame with processed data
-        result_df = pd.DataFrame(processed_data, columns=[
-            'Product Number',
-            'Natural Language Output',
-            'Product Description',
-            'LAZADA PRICES',
-            'SHOPEE PRICES'
-        ])
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv')
-        result_df.to_csv(temp_file.name, index=False)
-        logger.info(f"Results saved to {temp_file.name}")
-        
-        return FileResponse(
-            temp_file.name,
+
+        # Only the upload reads stay on the event loop; parsing and the
+        # pipeline are blocking CPU work and run in the threadpool so
+        # concurrent requests don't serialize behind them
+        contents1 = await file1.read()
+        contents2 = await file2.read()
+        df1, df2 = await asyncio.gather(
+            run_in_threadpool(read_df, contents1, file1.filename),
+            run_in_threadpool(read_df, contents2, file2.filename)
+        )
+
+        result_df = await run_in_threadpool(build_result, df1, df2)
+
+        # Stream the CSV straight to the client instead of writing a temp
+        # file first; serialization and download overlap per chunk
+        logger.info(f"Streaming {len(result_df)} result rows")
+        return StreamingResponse(
+            iter_csv(result_df),
             media_type='text/csv',
-            filename='comparison_results.csv',
-            background=None
+            headers={'Content-Disposition': 'attachment; filename=comparison_results.csv'}
         )
     except Exception as e:
         logger.error(f"Error in process_csv: {str(e)}")
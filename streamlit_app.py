@@ -1,11 +1,16 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import tempfile
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from lxml.etree import strip_elements
 import io
-import time
+import multiprocessing
+import os
 import re
-from functools import lru_cache
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 # Set page config for better performance
 st.set_page_config(
@@ -20,45 +25,69 @@ if 'processed_data' not in st.session_state:
 if 'result_df' not in st.session_state:
     st.session_state.result_df = None
 
-# Cache for HTML parsing and price extraction
-@lru_cache(maxsize=1000)
+# One libxml2 parser per thread: reusing it keeps its internal buffers and
+# error-recovery tables warm instead of re-allocating them per document, but
+# lxml parser objects are not thread-safe and Streamlit runs each session's
+# script on its own thread
+_parser_local = threading.local()
+
+def _get_html_parser():
+    parser = getattr(_parser_local, 'parser', None)
+    if parser is None:
+        parser = lxml_html.HTMLParser(recover=True, remove_comments=True, remove_pis=True)
+        _parser_local.parser = parser
+    return parser
+
 def html_to_text(html_content):
-    """Convert HTML to text with caching for better performance."""
+    """Convert HTML to text."""
+    # Guard against NaN/None cells coming out of pandas
+    if not isinstance(html_content, str) or not html_content:
+        return ""
+    # Plain-text cells are common; when there is no markup at all, skip
+    # DOM construction and just normalize the whitespace
+    if '<' not in html_content:
+        return ' '.join(html_content.split())
     try:
-        # Check if the content is NaN or None
-        if pd.isna(html_content) or html_content is None:
-            return ""
-            
-        # Convert to string if not already
-        html_content = str(html_content)
-        
-        # Use html.parser instead of lxml for better compatibility
-        soup = BeautifulSoup(html_content, 'html.parser')
+        # Parse with lxml directly; it keeps the tree in C instead of
+        # building a Python object per node like BeautifulSoup
+        tree = lxml_html.fromstring(html_content, parser=_get_html_parser())
         # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
+        strip_elements(tree, 'script', 'style', with_tail=False)
         # Get text and normalize whitespace
-        text = soup.get_text(separator=' ', strip=True)
-        # Remove extra whitespace
-        text = ' '.join(text.split())
-        return text
+        return ' '.join(tree.text_content().split())
     except Exception as e:
         st.error(f"Error converting HTML to text: {str(e)}")
         return str(html_content)
 
-# Compile regex pattern once for better performance
+# Compile regex pattern once for better performance. The currency
+# alternation and the amount grammar are factored into single subpatterns
+# shared by the symbol-prefix and symbol-suffix forms, which keeps the
+# alternation shallow and backtracking to a minimum.
+_CURRENCY = r'(?:[\$₱£€¥₹]|PHP|USD|EUR|GBP|JPY|INR)'
+_AMOUNT = r'\d+(?:,\d{3})*(?:\.\d{2})?'
+# re.ASCII skips Unicode case folding and digit classes; every casing and
+# digit in the grammar is plain ASCII
 PRICE_PATTERN = re.compile(
-    r'(?:(?:[\$₱£€¥₹]|(?:PHP|USD|EUR|GBP|JPY|INR))\s*\d+(?:,\d{3})*(?:\.\d{2})?|\d+(?:,\d{3})*(?:\.\d{2})?\s*(?:[\$₱£€¥₹]|(?:PHP|USD|EUR|GBP|JPY|INR)))',
-    re.IGNORECASE
+    r'(?:{cur}\s*{amt}|{amt}\s*{cur})'.format(cur=_CURRENCY, amt=_AMOUNT),
+    re.IGNORECASE | re.ASCII
 )
 
-@lru_cache(maxsize=1000)
+# Cheap prefilter: most descriptions contain no currency token at all, so
+# the full pattern can be skipped unless a currency symbol or ISO code is
+# actually present.
+_CURRENCY_CHARS = '$₱£€¥₹'
+_CURRENCY_CODES = re.compile(r'PHP|USD|EUR|GBP|JPY|INR', re.IGNORECASE | re.ASCII)
+
 def extract_prices(text):
-    """Extract prices from text with caching for better performance."""
-    if not text:
+    """Extract prices from text."""
+    if not isinstance(text, str) or not text:
+        return ''
+    # Each `in` check is a C-level substring scan; no set of the whole
+    # text gets allocated just to test membership
+    if not (any(c in text for c in _CURRENCY_CHARS) or _CURRENCY_CODES.search(text)):
         return ''
-    prices = PRICE_PATTERN.findall(text)
-    return ' | '.join(prices) if prices else ''
+    # finditer feeds the join directly without building a match list first
+    return ' | '.join(m.group() for m in PRICE_PATTERN.finditer(text))
 
 def validate_csv_structure(df1, df2):
     """Validate the structure of both files with improved error handling."""
@@ -72,40 +101,126 @@ def validate_csv_structure(df1, df2):
     
     return df1_columns[0], df1_columns[1], df2_columns[1], df2_columns[3]
 
+def _missing_count(series):
+    """Count missing values, treating NaN as missing on every backend."""
+    # Arrow float columns report NaN as valid, so isna() alone undercounts
+    # there; series != series flags NaN regardless of backend, and the two
+    # masks are OR-ed so numpy floats (where isna() does see NaN) are not
+    # counted twice
+    mask = (series.isna().to_numpy(dtype=bool)
+            | (series != series).fillna(False).to_numpy(dtype=bool))
+    return int(mask.sum())
+
+def align_key_dtypes(df1, df2, key1, key2):
+    """Cast both product-number columns to a shared dtype before joining."""
+    # Hashing fixed-width numbers beats hashing Python string objects, and
+    # a dtype mismatch between the two files (one read as numbers, the
+    # other as strings) would make every lookup miss
+    n1 = pd.to_numeric(df1[key1], errors='coerce')
+    n2 = pd.to_numeric(df2[key2], errors='coerce')
+    # Coercion failures can come back as NaN floats rather than proper NA
+    # (Arrow-backed columns do this, and Arrow NaN doesn't count as null),
+    # so compare missing counts against the originals instead of trusting
+    # notna()
+    if (_missing_count(n1) == _missing_count(df1[key1])
+            and _missing_count(n2) == _missing_count(df2[key2])):
+        df1[key1] = n1
+        df2[key2] = n2
+    else:
+        # Keep missing keys missing; a bare astype(str) would turn them
+        # into the literal string 'nan' and let blank SKUs join each other
+        df1[key1] = df1[key1].astype(str).mask(df1[key1].isna())
+        df2[key2] = df2[key2].astype(str).mask(df2[key2].isna())
+
 # Cache expensive operations
 @st.cache_data(ttl=3600)  # Cache for 1 hour
-def load_data(file):
-    """Load and cache file data."""
-    if file.name.endswith(".csv"):
-        return pd.read_csv(file)
+def load_data(name, data, usecols=None, str_cols=None):
+    """Load and cache file data, keyed on the file name and raw bytes."""
+    # Keying on (name, bytes) instead of the UploadedFile object means
+    # Streamlit reruns hit the cache while edited files still miss it
+    if name.endswith(".csv"):
+        # The Arrow engine only accepts column names, not positions, so
+        # probe the header first and translate. Missing positions are
+        # skipped so structure validation can report a friendly error.
+        header = pd.read_csv(io.BytesIO(data), nrows=0).columns
+        dtype = None
+        if str_cols is not None:
+            # Join keys load as text so they stringify exactly like the
+            # chunked reader's dtype=str keys, leading zeros included
+            dtype = {header[i]: str for i in str_cols if i < len(header)}
+        if usecols is not None:
+            usecols = [header[i] for i in usecols if i < len(header)]
+        # The Arrow engine parses CSV multi-threaded in C++ and backs string
+        # columns with Arrow buffers instead of one Python object per cell
+        return pd.read_csv(io.BytesIO(data), engine='pyarrow', dtype_backend='pyarrow',
+                           usecols=usecols, dtype=dtype)
     else:
-        return pd.read_excel(file)
-
-@st.cache_data(ttl=3600)
-def process_batch(batch_df, df2, product_col1, html_col, product_col2, desc_col):
-    """Process a batch of rows."""
-    processed_data = []
-    for _, row in batch_df.iterrows():
-        try:
-            product_number = row[product_col1]
-            html_content = row[html_col]
-            text_content = html_to_text(html_content)
-            
-            matching_product = df2[df2[product_col2] == product_number]
-            if not matching_product.empty:
-                product_description = matching_product.iloc[0][desc_col]
-                prices1 = extract_prices(text_content)
-                prices2 = extract_prices(product_description)
-                processed_data.append([
-                    product_number,
-                    text_content,
-                    product_description,
-                    prices1,
-                    prices2
-                ])
-        except Exception as e:
-            continue
-    return processed_data
+        frame = pd.read_excel(io.BytesIO(data), usecols=usecols)
+        if str_cols is not None:
+            for i in str_cols:
+                if i < len(frame.columns):
+                    col = frame.columns[i]
+                    frame[col] = frame[col].astype(str).mask(frame[col].isna())
+        return frame
+
+def convert_html_column(frame, html_col, progress=None):
+    """Attach a '_text' column, parsing each distinct HTML blob once."""
+    # Catalogs reuse template HTML across SKUs; convert each distinct blob
+    # once and map the texts back onto the rows
+    uniq_html = frame[html_col].dropna().unique()
+    total = len(uniq_html)
+    step = max(total // 20, 1)
+    texts = []
+
+    # HTML -> text is CPU-bound and embarrassingly parallel, so fan it out
+    # across processes for large inputs. Fork keeps the workers from
+    # re-executing this script the way spawn would; small inputs skip the
+    # pool startup cost entirely. The optional progress callback fires
+    # about every 5% of completions.
+    if total >= 500 and hasattr(os, 'fork'):
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=ctx) as executor:
+            for i, text in enumerate(executor.map(html_to_text, uniq_html, chunksize=64), 1):
+                texts.append(text)
+                if progress is not None and (i % step == 0 or i == total):
+                    progress(i / total)
+    else:
+        for i, h in enumerate(uniq_html, 1):
+            texts.append(html_to_text(h))
+            if progress is not None and (i % step == 0 or i == total):
+                progress(i / total)
+    frame['_text'] = frame[html_col].map(dict(zip(uniq_html, texts))).fillna('')
+    # The raw HTML is by far the largest column and is never read again;
+    # free it before the regex stage
+    frame.drop(columns=[html_col], inplace=True)
+
+def build_result_frame(frame, product_col1):
+    """Extract prices for rows that already carry their text and description."""
+    # map(extract_prices) keeps the cheap currency prefilter in the loop:
+    # rows with no currency token skip the full pattern entirely, which
+    # str.findall would run on every row
+    text_series = frame['_text']
+    desc_series = frame['_description']
+    return pd.DataFrame({
+        'Product Number': frame[product_col1].to_numpy(),
+        'Natural Language Output': text_series.to_numpy(),
+        'Product Description': desc_series.to_numpy(),
+        'LAZADA PRICES': text_series.map(extract_prices).to_numpy(),
+        'SHOPEE PRICES': desc_series.map(extract_prices).to_numpy()
+    })
+
+def match_chunk(chunk, key, desc_by_id):
+    """Keep the rows of one chunk whose product number has a description."""
+    # Rows with no key read as NaN (the reader loads the key as text) and
+    # never have a legitimate match, so they drop out here
+    chunk = chunk.dropna(subset=[key])
+    matched = chunk[chunk[key].astype(str).isin(desc_by_id)].copy()
+    matched[key] = matched[key].astype(str)
+    return matched
+
+# Stream file1 in chunks above this size instead of materializing it whole
+_CHUNKED_CSV_BYTES = 64 * 1024 * 1024
+_CHUNK_ROWS = 10000
 
 st.title("HTML to CSV Price Checker (Streamlit)")
 
@@ -121,9 +236,21 @@ with col2:
 if file1 and file2:
     try:
         # Show loading spinner while reading files
+        # Only materialize the columns the pipeline reads: product number +
+        # HTML from the first file, the first four columns of the second
+        raw1 = file1.getvalue()
+        chunked = file1.name.endswith(".csv") and len(raw1) > _CHUNKED_CSV_BYTES
         with st.spinner('Reading files...'):
-            df1 = load_data(file1)
-            df2 = load_data(file2)
+            if chunked:
+                # Header-only probe; the rows stream chunk by chunk at
+                # process time so peak memory stays at one chunk of HTML
+                df1 = pd.read_csv(io.BytesIO(raw1), nrows=0, usecols=[0, 1])
+            else:
+                df1 = load_data(file1.name, raw1, usecols=[0, 1])
+            # In chunked mode the join key must stringify the same way on
+            # both sides, so df2's key column is read as text too
+            df2 = load_data(file2.name, file2.getvalue(), usecols=[0, 1, 2, 3],
+                            str_cols=[1] if chunked else None)
 
         # Validate and get columns
         product_col1, html_col, product_col2, desc_col = validate_csv_structure(df1, df2)
@@ -134,45 +261,78 @@ if file1 and file2:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Process in batches
-            batch_size = 100
-            total_rows = len(df1)
             processed_data = []
-            
-            for i in range(0, total_rows, batch_size):
-                batch_df = df1.iloc[i:i+batch_size]
-                batch_results = process_batch(batch_df, df2, product_col1, html_col, product_col2, desc_col)
-                processed_data.extend(batch_results)
-                
-                # Update progress
-                progress = min((i + batch_size) / total_rows, 1.0)
-                progress_bar.progress(progress)
-                status_text.text(f"Processing rows {i+1} to {min(i+batch_size, total_rows)} of {total_rows}")
-                
-                # Add a small delay to allow UI updates
-                time.sleep(0.1)
+
+            if chunked:
+                # Streamed mode: the chunked reader infers dtypes per chunk,
+                # so one blank key would promote an integer key column to
+                # float in that chunk only and its keys would stringify as
+                # "11.0" instead of "11". Loading the key as text on both
+                # sides (dtype=str here, str_cols on df2 above) keeps the
+                # join stable; the first occurrence of a repeated product
+                # number wins
+                df2_keyed = (df2.dropna(subset=[product_col2])
+                             .drop_duplicates(subset=[product_col2]))
+                desc_by_id = dict(zip(df2_keyed[product_col2].astype(str).to_numpy(),
+                                      df2_keyed[desc_col].to_numpy()))
+                rows_done = 0
+                reader = pd.read_csv(io.BytesIO(raw1), usecols=[0, 1],
+                                     dtype={product_col1: str}, chunksize=_CHUNK_ROWS)
+                for chunk in reader:
+                    rows_done += len(chunk)
+                    chunk = match_chunk(chunk, product_col1, desc_by_id)
+                    if not chunk.empty:
+                        chunk['_description'] = chunk[product_col1].map(desc_by_id)
+                        convert_html_column(chunk, html_col)
+                        processed_data.append(build_result_frame(chunk, product_col1))
+                    status_text.text(f"Processed {rows_done} rows...")
+                progress_bar.progress(1.0)
+            else:
+                # Resolve the join once: index df2 by product number, drop
+                # unmatched rows, and attach the description as a column
+                align_key_dtypes(df1, df2, product_col1, product_col2)
+                # Rows with no key at all never have a legitimate match and
+                # a NaN dict key would foul the lookup, so drop them up front;
+                # the first occurrence of a repeated product number wins
+                df1 = df1.dropna(subset=[product_col1])
+                df2_keyed = (df2.dropna(subset=[product_col2])
+                             .drop_duplicates(subset=[product_col2]))
+                desc_by_id = dict(zip(df2_keyed[product_col2].to_numpy(),
+                                      df2_keyed[desc_col].to_numpy()))
+                df1 = df1[df1[product_col1].isin(desc_by_id)].copy()
+                df1['_description'] = df1[product_col1].map(desc_by_id)
+
+                # One vectorized pass over the whole frame; the conversion
+                # step (the only slow one) drives the progress bar
+                status_text.text(f"Processing {len(df1)} rows...")
+                convert_html_column(df1, html_col, progress=progress_bar.progress)
+                if not df1.empty:
+                    processed_data.append(build_result_frame(df1, product_col1))
+                progress_bar.progress(1.0)
 
             if processed_data:
                 # Store in session state
                 st.session_state.processed_data = processed_data
-                st.session_state.result_df = pd.DataFrame(processed_data, columns=[
-                    'Product Number',
-                    'Natural Language Output',
-                    'Product Description',
-                    'LAZADA PRICES',
-                    'SHOPEE PRICES'
-                ])
+                st.session_state.result_df = pd.concat(processed_data, ignore_index=True)
                 
                 # Clear progress indicators
                 progress_bar.empty()
                 status_text.empty()
                 
-                # Display results
+                # Display results; cap the preview so huge results don't get
+                # serialized into the page wholesale
                 st.success("Processing complete!")
-                st.dataframe(st.session_state.result_df)
+                st.dataframe(st.session_state.result_df.head(1000))
                 
-                # Download button
-                csv = st.session_state.result_df.to_csv(index=False).encode('utf-8')
+                # Download button. Arrow's C++ CSV writer emits UTF-8 into a
+                # single buffer, avoiding the full-result Python string plus
+                # its encoded copy that to_csv().encode() would build
+                sink = pa.BufferOutputStream()
+                pa_csv.write_csv(
+                    pa.Table.from_pandas(st.session_state.result_df, preserve_index=False),
+                    sink
+                )
+                csv = bytes(sink.getvalue())
                 st.download_button(
                     label="Download results as CSV",
                     data=csv,
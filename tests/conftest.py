@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Make backend.main and streamlit_app importable when pytest runs from
+# anywhere in the tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
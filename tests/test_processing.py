@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+main = pytest.importorskip("backend.main")
+
+
+def _arrow_csv(text):
+    # Read the way both apps read uploads: Arrow engine, Arrow-backed columns
+    return pd.read_csv(io.BytesIO(text.encode()), engine='pyarrow',
+                       dtype_backend='pyarrow')
+
+
+def test_align_key_dtypes_keeps_alphanumeric_arrow_keys():
+    # to_numeric(errors='coerce') on Arrow-backed strings returns NaN floats
+    # that isna() does not count, so the numeric branch used to win for
+    # alphanumeric SKUs and wipe every key to NaN
+    df1 = _arrow_csv("id,html\nAB-1,<p>a</p>\nAB-2,<p>b</p>\n")
+    df2 = _arrow_csv("x,id,y,desc\n1,AB-1,1,first\n2,AB-2,2,second\n")
+    main.align_key_dtypes(df1, df2, 'id', 'id')
+    assert df1['id'].tolist() == ['AB-1', 'AB-2']
+    assert df2['id'].tolist() == ['AB-1', 'AB-2']
+
+
+def test_align_key_dtypes_still_takes_numeric_path_for_numeric_keys():
+    df1 = _arrow_csv("id,html\n11,<p>a</p>\n12,<p>b</p>\n")
+    df2 = pd.DataFrame({'x': [0, 0], 'id': ['11', '12'],
+                        'y': [0, 0], 'desc': ['first', 'second']})
+    main.align_key_dtypes(df1, df2, 'id', 'id')
+    assert df1['id'].tolist() == df2['id'].tolist()
+
+
+def test_chunked_match_keeps_rows_sharing_a_chunk_with_a_blank_key():
+    # A blank key used to promote the whole chunk's integer key column to
+    # float, stringify its keys as "11.0", and drop every valid row with it
+    app = pytest.importorskip("streamlit_app")
+    rows = "".join(f"{i},<p>{i}</p>\n" for i in range(1, 10))
+    csv1 = "id,html\n" + rows + ",<p>blank</p>\n"
+    desc_by_id = {str(i): f"desc {i}" for i in range(1, 10)}
+    reader = pd.read_csv(io.BytesIO(csv1.encode()), usecols=[0, 1],
+                         dtype={'id': str}, chunksize=10)
+    kept = [app.match_chunk(chunk, 'id', desc_by_id) for chunk in reader]
+    assert sum(len(c) for c in kept) == 9